@@ -1,50 +1,173 @@
 import os
 import sys
+import glob
+import select
 import signal
 import platform
+import re
 import argparse
 import subprocess
 import time
+import struct
+import json
+import http.client
+from collections import deque
 
-def run_command(command, shell=False, threads=2, is_conversation=False):
+# The llama-cli process being run, and whether Ctrl+C was passed on to it
+current_process = None
+interrupted = False
+
+# Background llama-server state for --server mode
+SERVER_STATE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bitnet")
+SERVER_PID_FILE = os.path.join(SERVER_STATE_DIR, "server.pid")
+SERVER_STARTUP_TIMEOUT = 300
+
+# Classifies a llama-cli output line in a single pass; the name of the
+# matching group tells the read loop what kind of line it is looking at.
+OUTPUT_PATTERN = re.compile(
+    r'(?P<gen_start>generate: n_ctx)'
+    r'|(?P<perf>llama_perf_|load time|prompt eval|eval time|total time|sampling time)'
+    r'|(?P<sampler>^sampler)'
+    r'|(?P<user_turn>^\s*> )'
+    r'|(?P<system>^\s*System:)'
+    r'|(?P<blank>^\s*$)'
+)
+
+# Matches llama_perf timing lines such as:
+#   prompt eval time = 161.62 ms / 2 tokens ( 80.81 ms per token, 12.37 tokens per second)
+#          eval time = 2136.86 ms / 19 runs ( 112.47 ms per token, 8.89 tokens per second)
+PERF_PATTERN = re.compile(
+    r'(?P<stage>prompt eval|eval) time\s*=\s*[\d.]+ ms /\s*\d+ \S+\s*'
+    r'\(\s*(?P<ms_per_token>[\d.]+) ms per token,\s*(?P<tokens_per_sec>[\d.]+) tokens per second\)'
+)
+
+# Metric names for each PERF_PATTERN stage, as (tokens/sec key, ms/token key)
+PERF_METRIC_KEYS = {
+    'prompt eval': ('prompt_eval_speed', 'prompt_eval_ms_per_token'),
+    'eval': ('gen_speed', 'gen_ms_per_token'),
+}
+
+def stream_output(pipe, mirror, chunk_size=65536, timeout=0.1):
+    """Mirror a child's raw output pipe to `mirror` and yield its completed lines as text (without newlines)."""
+    fd = pipe.fileno()
+    # Windows cannot select() on pipes; a blocking read returns whatever is available there
+    use_select = platform.system() != "Windows"
+    if use_select:
+        os.set_blocking(fd, False)
+    pending = bytearray()
+    while True:
+        if use_select:
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if not ready:
+                continue
+        try:
+            chunk = os.read(fd, chunk_size)
+        except BlockingIOError:
+            continue
+        if not chunk:
+            break
+        if mirror is sys.stdout.buffer:
+            # Banners printed through the text layer must land before this chunk
+            sys.stdout.flush()
+        mirror.write(chunk)
+        mirror.flush()
+        pending.extend(chunk)
+        end = pending.rfind(b'\n')
+        if end < 0:
+            continue
+        # Decode every completed line of the chunk at once; a newline byte
+        # never falls inside a multi-byte UTF-8 sequence
+        completed = pending[:end].decode('utf-8', errors='replace')
+        del pending[:end + 1]
+        yield from completed.split('\n')
+    if pending:
+        yield pending.decode('utf-8', errors='replace')
+
+def print_speed_metrics(performance_metrics, total_time, threads, prompts=1):
+    """Print the per-run speed summary shown after a one-shot generation."""
+    print(f"\n" + "="*60)
+    print(f"⚡ SPEED METRICS")
+    print(f"="*60)
+    if prompts > 1:
+        print(f"📦 Prompts in batch: {prompts}")
+    if 'prompt_eval_speed' in performance_metrics:
+        print(f"📝 Prompt evaluation: {performance_metrics['prompt_eval_speed']:.2f} tokens/sec ({performance_metrics['prompt_eval_ms_per_token']:.2f} ms/token)")
+    if 'gen_speed' in performance_metrics:
+        print(f"🚀 Text generation: {performance_metrics['gen_speed']:.2f} tokens/sec ({performance_metrics['gen_ms_per_token']:.2f} ms/token)")
+    print(f"⏱️  Total inference time: {total_time:.2f} seconds")
+    print(f"🔧 ARM dot product optimizations: ENABLED")
+    print(f"🧠 Model: BitNet 2B (ARM-optimized)")
+    print(f"🏃 Threads used: {threads}")
+    print(f"="*60)
+
+def print_json_metrics(performance_metrics, total_time, prompts=1, interrupted=False):
+    """Print the run's metrics as a single JSON object for benchmark harnesses."""
+    json.dump(dict(performance_metrics, total_time=total_time, prompts=prompts, interrupted=interrupted), sys.stdout)
+    print()
+
+def run_command(command, threads=2, is_conversation=False, affinity=None, json_output=False):
     """Run a system command with real-time output and extract performance metrics."""
+    global current_process, interrupted
     try:
-        print("🚀 Starting BitNet inference with ARM optimizations...\n")
+        if not json_output:
+            print("🚀 Starting BitNet inference with ARM optimizations...\n", flush=True)
         start_time = time.time()
         
-        # Run the command with real-time output and capture stderr for performance metrics
-        process = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE, 
-                                 stderr=subprocess.STDOUT, text=True, bufsize=1, universal_newlines=True)
+        # Python opens its own fds non-inheritable, so there is nothing for the
+        # child to close. close_fds=False skips the close loop, and lets the
+        # conversation path use posix_spawn; the one-shot path's new session
+        # (and --json's redirect of stdout to fd 2) still rule posix_spawn out
+        if is_conversation:
+            # Turn detection needs the token stream, so both streams pass through us
+            process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, bufsize=0, close_fds=False)
+            output = stream_output(process.stdout, sys.stdout.buffer)
+        else:
+            # Tokens go straight to the terminal; only the log stream, which
+            # carries the llama_perf timings, is read back for metrics. A
+            # session of its own keeps terminal Ctrl+C from reaching it, so
+            # signal_handler forwards exactly one SIGINT. With --json, stdout
+            # is reserved for the metrics and the text goes to stderr instead
+            process = subprocess.Popen(command, stdout=sys.stderr.fileno() if json_output else None,
+                                     stderr=subprocess.PIPE, bufsize=0, close_fds=False,
+                                     start_new_session=True)
+            output = stream_output(process.stderr, sys.stderr.buffer)
+        current_process = process
+        interrupted = False
+        
+        # Pin before llama-cli has loaded the model; its worker threads inherit the mask
+        if affinity:
+            try:
+                os.sched_setaffinity(process.pid, affinity)
+            except OSError as e:
+                print(f"⚠️  Could not pin llama-cli to CPUs {affinity}: {e}", file=sys.stderr)
         
-        output_lines = []
-        model_response_started = False
-        model_response_lines = []
+        # Only the timing lines are parsed after exit, so keep just the tail of those
+        perf_lines = deque(maxlen=64)
         last_response_time = time.time()
         response_count = 0
         in_assistant_response = False
         
-        # Read output line by line in real-time
-        for line in process.stdout:
-            output_lines.append(line)
-            print(line, end='')
+        # Read output in large chunks; raw bytes are mirrored as they arrive
+        for line in output:
+            match = OUTPUT_PATTERN.search(line)
+            kind = match.lastgroup if match else None
             
             # Detect when model response starts (after the prompt)
-            if 'generate: n_ctx' in line:
-                model_response_started = True
+            if kind == 'gen_start':
                 last_response_time = time.time()
-            elif model_response_started and 'llama_perf_' not in line and line.strip() and not line.startswith('sampler'):
-                if not any(keyword in line for keyword in ['load time', 'prompt eval', 'eval time', 'total time', 'sampling time']):
-                    model_response_lines.append(line)
+            elif kind == 'perf':
+                perf_lines.append(line)
             
             # In conversation mode, show timing after each complete response
             if is_conversation:
                 # Look for the start of a new assistant response
-                if line.strip().startswith('> ') and not in_assistant_response:
+                if kind == 'user_turn' and not in_assistant_response:
                     # Starting a new assistant response
                     in_assistant_response = True
                     last_response_time = time.time()
                 # Look for the end of assistant response - when we see a new user input
-                elif in_assistant_response and line.strip() and not line.strip().startswith('> ') and not line.strip().startswith('System:'):
+                elif in_assistant_response and kind not in ('blank', 'user_turn', 'system'):
                     # End of assistant response - show metrics
                     response_count += 1
                     current_time = time.time()
@@ -65,9 +188,15 @@ def run_command(command, shell=False, threads=2, is_conversation=False):
         
         # Wait for process to complete
         process.wait()
+        current_process = None
         
-        if process.returncode != 0:
-            print(f"❌ Error occurred while running command. Exit code: {process.returncode}")
+        # In conversation mode llama-cli handles Ctrl+C, printing its timings
+        # and exiting with 130. One-shot runs install no handler, so they die
+        # from the forwarded SIGINT and their timings are lost
+        if process.returncode in (130, -signal.SIGINT):
+            interrupted = True
+        if process.returncode != 0 and not interrupted:
+            print(f"❌ Error occurred while running command. Exit code: {process.returncode}", file=sys.stderr)
             sys.exit(1)
         
         end_time = time.time()
@@ -76,49 +205,19 @@ def run_command(command, shell=False, threads=2, is_conversation=False):
         # Extract performance metrics from output (for non-conversation mode)
         if not is_conversation:
             performance_metrics = {}
-            for line in output_lines:
-                if 'prompt eval time' in line:
-                    # Extract: prompt eval time = 161.62 ms / 2 tokens ( 80.81 ms per token, 12.37 tokens per second)
-                    parts = line.split('=')[1].strip() if '=' in line else ""
-                    if 'ms per token' in parts and 'tokens per second' in parts:
-                        try:
-                            # Extract tokens per second for prompt eval
-                            tokens_per_sec = parts.split('tokens per second')[0].split(',')[-1].strip()
-                            performance_metrics['prompt_eval_speed'] = float(tokens_per_sec)
-                            
-                            # Extract ms per token for prompt eval  
-                            ms_per_token = parts.split('ms per token')[0].split('(')[-1].strip()
-                            performance_metrics['prompt_eval_ms_per_token'] = float(ms_per_token)
-                        except:
-                            pass
-                elif 'eval time' in line and 'prompt eval' not in line:
-                    # Extract: eval time = 2136.86 ms / 19 runs ( 112.47 ms per token, 8.89 tokens per second)
-                    parts = line.split('=')[1].strip() if '=' in line else ""
-                    if 'ms per token' in parts and 'tokens per second' in parts:
-                        try:
-                            # Extract tokens per second for generation
-                            tokens_per_sec = parts.split('tokens per second')[0].split(',')[-1].strip()
-                            performance_metrics['gen_speed'] = float(tokens_per_sec)
-                            
-                            # Extract ms per token for generation
-                            ms_per_token = parts.split('ms per token')[0].split('(')[-1].strip()
-                            performance_metrics['gen_ms_per_token'] = float(ms_per_token)
-                        except:
-                            pass
+            for match in PERF_PATTERN.finditer('\n'.join(perf_lines)):
+                speed_key, ms_key = PERF_METRIC_KEYS[match.group('stage')]
+                try:
+                    performance_metrics[speed_key] = float(match.group('tokens_per_sec'))
+                    performance_metrics[ms_key] = float(match.group('ms_per_token'))
+                except ValueError:
+                    pass
             
             # Display speed metrics right after model response
-            print(f"\n" + "="*60)
-            print(f"⚡ SPEED METRICS")
-            print(f"="*60)
-            if 'prompt_eval_speed' in performance_metrics:
-                print(f"📝 Prompt evaluation: {performance_metrics['prompt_eval_speed']:.2f} tokens/sec ({performance_metrics['prompt_eval_ms_per_token']:.2f} ms/token)")
-            if 'gen_speed' in performance_metrics:
-                print(f"🚀 Text generation: {performance_metrics['gen_speed']:.2f} tokens/sec ({performance_metrics['gen_ms_per_token']:.2f} ms/token)")
-            print(f"⏱️  Total inference time: {total_time:.2f} seconds")
-            print(f"🔧 ARM dot product optimizations: ENABLED")
-            print(f"🧠 Model: BitNet 2B (ARM-optimized)")
-            print(f"🏃 Threads used: {threads}")
-            print(f"="*60)
+            if json_output:
+                print_json_metrics(performance_metrics, total_time, interrupted=interrupted)
+            else:
+                print_speed_metrics(performance_metrics, total_time, threads)
         else:
             # For conversation mode, show final summary
             print(f"\n" + "="*60)
@@ -131,63 +230,503 @@ def run_command(command, shell=False, threads=2, is_conversation=False):
             print(f"🏃 Threads used: {threads}")
             print(f"="*60)
         
+        if interrupted and not json_output:
+            print("\n👋 Inference interrupted by user")
         return process.returncode
         
     except subprocess.CalledProcessError as e:
-        print(f"❌ Error occurred while running command: {e}")
+        print(f"❌ Error occurred while running command: {e}", file=sys.stderr)
         sys.exit(1)
-    except KeyboardInterrupt:
-        print(f"\n" + "="*60)
-        print(f"⚡ PERFORMANCE SUMMARY (Interrupted)")
-        print(f"="*60)
-        end_time = time.time()
-        total_time = end_time - start_time
-        print(f"⏱️  Runtime before interruption: {total_time:.2f} seconds")
-        print(f"🔧 ARM dot product optimizations: ENABLED")
-        print(f"🧠 Model: BitNet 2B (ARM-optimized)")
-        print(f"🏃 Threads used: {threads}")
-        print(f"💡 Tip: For detailed timing, run without -cnv flag")
-        print(f"="*60)
-        print("\n👋 Inference interrupted by user")
-        sys.exit(0)
 
-def run_inference():
+def read_sysfs(path):
+    """Return the stripped contents of a sysfs file, or None if it cannot be read."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def allowed_cpus():
+    """Return the set of CPU ids this process may run on (taskset, cgroup cpuset), or None if unknown."""
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    try:
+        return os.sched_getaffinity(0)
+    except OSError:
+        return None
+
+def cgroup_cpu_limit():
+    """Return the cgroup v2 CPU quota rounded up to whole CPUs, or None if unlimited."""
+    quota = read_sysfs("/sys/fs/cgroup/cpu.max")
+    try:
+        limit, period = quota.split()
+        return max(1, -(-int(limit) // int(period)))
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+
+def detect_performance_cores():
+    """Return one logical CPU id per physical core in the fastest cluster (Linux only), or None if unknown."""
+    cpu_root = "/sys/devices/system/cpu"
+    # ARM kernels publish a normalized per-CPU capacity; elsewhere fall back
+    # to each CPU's maximum frequency
+    capacities = {}
+    for source in ("cpu_capacity", os.path.join("cpufreq", "cpuinfo_max_freq")):
+        for cpu in glob.glob(os.path.join(cpu_root, "cpu[0-9]*")):
+            value = read_sysfs(os.path.join(cpu, source))
+            if value is not None:
+                capacities[int(os.path.basename(cpu)[3:])] = int(value)
+        if capacities:
+            break
+    # sysfs lists every host CPU; only consider the ones we are allowed to use
+    allowed = allowed_cpus()
+    if allowed is not None:
+        capacities = {cpu_id: value for cpu_id, value in capacities.items() if cpu_id in allowed}
+    if not capacities:
+        return None
+
+    # On big.LITTLE parts only the top cluster is worth running on. The
+    # tolerance keeps x86 "favored" cores, which boost a little higher than
+    # their siblings, from shrinking the cluster to one or two CPUs. SMT
+    # siblings share a core, so keep a single thread per physical core
+    threshold = max(capacities.values()) * 0.9
+    cores = []
+    seen = set()
+    for cpu_id in sorted(capacities):
+        if capacities[cpu_id] < threshold:
+            continue
+        topology = os.path.join(cpu_root, f"cpu{cpu_id}", "topology")
+        core = (read_sysfs(os.path.join(topology, "physical_package_id")),
+                read_sysfs(os.path.join(topology, "core_id")))
+        if core[1] is not None and core in seen:
+            continue
+        seen.add(core)
+        cores.append(cpu_id)
+    return cores
+
+def parse_cpu_list(cpu_list):
+    """Parse a Linux-style CPU list such as "4-7,9" into a list of CPU ids."""
+    cpus = []
+    for part in cpu_list.split(','):
+        start, dash, end = part.partition('-')
+        start, end = int(start), int(end) if dash else int(start)
+        if start < 0 or end < start:
+            raise ValueError(f"invalid CPU range {part!r}")
+        cpus.extend(range(start, end + 1))
+    return cpus
+
+def affinity_arg(value):
+    """argparse type for --affinity: 'none' or a CPU list such as "4-7,9"."""
+    if value == "none":
+        return value
+    try:
+        return parse_cpu_list(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid CPU list {value!r}, expected e.g. 4-7 or 0,2,4 or 'none'")
+
+def default_thread_count():
+    """Pick a thread count matching the performance cores available to this process."""
+    if platform.system() == "Linux":
+        cores = detect_performance_cores()
+        if cores:
+            return min(len(cores), cgroup_cpu_limit() or len(cores))
+    elif platform.system() == "Darwin":
+        try:
+            result = subprocess.run(["sysctl", "-n", "hw.perflevel0.physicalcpu"],
+                                    capture_output=True, text=True, check=True)
+            return int(result.stdout.strip())
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    allowed = allowed_cpus()
+    cpu_count = len(allowed) if allowed is not None else (os.cpu_count() or 2)
+    return max(1, min(cpu_count // 2, cgroup_cpu_limit() or cpu_count))
+
+def select_affinity():
+    """Return the CPUs to pin llama-cli to, or None to leave scheduling to the kernel."""
+    if not hasattr(os, "sched_setaffinity"):
+        return None
+    if args.affinity is not None:
+        return None if args.affinity == "none" else args.affinity
+    # Keep workers off the LITTLE cores, but never squeeze more threads than
+    # there are performance cores onto them. The detected cores are already
+    # limited to our own CPU mask, so pinning never widens what taskset or a
+    # container cpuset allowed; if none of them are allowed, nothing is pinned
+    cores = detect_performance_cores()
+    if cores and args.threads <= len(cores):
+        return cores[:args.threads]
+    return None
+
+def binary_path(name):
+    """Return the path of a llama.cpp binary in the build directory."""
     build_dir = "build"
     if platform.system() == "Windows":
-        main_path = os.path.join(build_dir, "bin", "Release", "llama-cli.exe")
-        if not os.path.exists(main_path):
-            main_path = os.path.join(build_dir, "bin", "llama-cli")
+        path = os.path.join(build_dir, "bin", "Release", f"{name}.exe")
+        if not os.path.exists(path):
+            path = os.path.join(build_dir, "bin", name)
     else:
-        main_path = os.path.join(build_dir, "bin", "llama-cli")
-    command = [
-        f'{main_path}',
+        path = os.path.join(build_dir, "bin", name)
+    return path
+
+def prefetch_model(path):
+    """Ask the kernel to start reading the model file so disk I/O overlaps llama.cpp's startup."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        elif platform.system() == "Darwin":
+            import fcntl
+            # struct radvisory { off_t ra_offset; int ra_count; }
+            count = min(os.fstat(fd).st_size, 2**31 - 1)
+            fcntl.fcntl(fd, getattr(fcntl, "F_RDADVISE", 44), struct.pack("qi4x", 0, count))
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def mmap_enabled():
+    """Return whether llama.cpp should memory-map the model."""
+    if args.mmap is not None:
+        return args.mmap
+    # Page faults on the mmap'd weights stall generation on Linux ARM hosts,
+    # so load the model into memory there unless the user asked otherwise
+    return not (platform.system() == "Linux" and platform.machine() in ("aarch64", "arm64"))
+
+def model_options(ctx_size=None):
+    """Return the model and runtime flags shared by llama-cli and llama-server."""
+    options = [
         '-m', args.model,
-        '-n', str(args.n_predict),
         '-t', str(args.threads),
-        '-p', args.prompt,
         '-ngl', '0',
-        '-c', str(args.ctx_size),
+        '-c', str(ctx_size or args.ctx_size),
+        '-b', str(args.batch_size),
+        '-ub', str(args.ubatch_size),
+    ]
+    if not mmap_enabled():
+        options.append("--no-mmap")
+    if args.mlock:
+        options.append("--mlock")
+    return options
+
+def server_request(port, method, path, body=None, timeout=None):
+    """Send a request to the local llama-server and return (status, decoded JSON or None)."""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        if body is None:
+            conn.request(method, path)
+        else:
+            conn.request(method, path, body=json.dumps(body), headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        data = response.read()
+    finally:
+        conn.close()
+    try:
+        return response.status, json.loads(data) if data else None
+    except ValueError:
+        return response.status, None
+
+def server_settings():
+    """Return the settings a background llama-server is launched with, as recorded in its state file."""
+    return {
+        "port": args.port,
+        "threads": args.threads,
+        "ctx_size": args.ctx_size,
+        "batch_size": args.batch_size,
+        "ubatch_size": args.ubatch_size,
+        "mmap": mmap_enabled(),
+        "mlock": args.mlock,
+    }
+
+def read_server_state():
+    """Return the recorded state of a background server that still answers /health, or None."""
+    try:
+        with open(SERVER_PID_FILE) as f:
+            state = json.load(f)
+        port = state["port"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    # A pid check cannot tell a reused pid from our server (and os.kill is not
+    # a probe on Windows), so ask the server itself
+    try:
+        status, _ = server_request(port, "GET", "/health", timeout=2)
+    except OSError:
+        status = None
+    if status != 200:
+        try:
+            os.remove(SERVER_PID_FILE)
+        except OSError:
+            pass
+        return None
+    return state
+
+def stop_process(process, timeout=10):
+    """Terminate a child process, killing it if it does not exit within `timeout` seconds."""
+    if process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def start_server(persistent=True):
+    """Launch llama-server in the background and wait until it has loaded the model.
+
+    Only a persistent server is recorded in the state file for later runs to reuse.
+    Returns the server state and its process.
+    """
+    prefetch_model(args.model)
+    os.makedirs(SERVER_STATE_DIR, exist_ok=True)
+    log_path = os.path.join(SERVER_STATE_DIR, "server.log")
+    # llama-server splits its context between slots, so give each slot a full -c
+    command = [binary_path("llama-server")] + model_options(args.ctx_size * args.parallel) + [
+        '--host', '127.0.0.1',
+        '--port', str(args.port),
+        '-np', str(args.parallel),
+        '-cb',
+    ]
+    if not args.json:
+        kind = "background" if persistent else "temporary"
+        print(f"🚀 Starting {kind} llama-server on port {args.port} (log: {log_path})...", flush=True)
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                   close_fds=False, start_new_session=True)
+    # The server has its own session, so the terminal's Ctrl+C never reaches
+    # it; if we exit for any reason (including signal_handler's sys.exit)
+    # before it is ready, stop it ourselves rather than leave it orphaned
+    try:
+        affinity = select_affinity()
+        if affinity:
+            try:
+                os.sched_setaffinity(process.pid, affinity)
+            except OSError as e:
+                print(f"⚠️  Could not pin llama-server to CPUs {affinity}: {e}", file=sys.stderr)
+        state = dict(server_settings(), pid=process.pid, model=args.model)
+        if persistent:
+            with open(SERVER_PID_FILE, "w") as f:
+                json.dump(state, f)
+
+        # /health answers 503 while the model is still loading
+        deadline = time.time() + SERVER_STARTUP_TIMEOUT
+        while time.time() < deadline:
+            if process.poll() is not None:
+                print(f"❌ llama-server exited with code {process.returncode}, see {log_path}", file=sys.stderr)
+                sys.exit(1)
+            try:
+                status, _ = server_request(args.port, "GET", "/health", timeout=1)
+                if status == 200:
+                    return state, process
+            except OSError:
+                pass
+            time.sleep(0.5)
+        print(f"❌ llama-server did not become ready within {SERVER_STARTUP_TIMEOUT} seconds, see {log_path}", file=sys.stderr)
+        sys.exit(1)
+    except BaseException:
+        stop_process(process)
+        if persistent:
+            try:
+                os.remove(SERVER_PID_FILE)
+            except OSError:
+                pass
+        raise
+
+def load_prompts():
+    """Return the prompts to run: the lines of the file for "-p @file", else the single prompt."""
+    if not args.prompt.startswith('@'):
+        return [args.prompt]
+    try:
+        with open(args.prompt[1:]) as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    except OSError as e:
+        print(f"❌ Could not read prompt file {args.prompt[1:]}: {e.strerror}", file=sys.stderr)
+        sys.exit(1)
+    if not prompts:
+        print(f"❌ No prompts found in {args.prompt[1:]}", file=sys.stderr)
+        sys.exit(1)
+    return prompts
+
+def parse_completions(result, count):
+    """Return the per-prompt completions from a /completion response, or None if its shape is unexpected."""
+    if isinstance(result, dict) and isinstance(result.get("results"), list):
+        # Older llama-server builds wrap multi-prompt results in an object
+        results = result["results"]
+    elif isinstance(result, list):
+        results = result
+    elif isinstance(result, dict):
+        results = [result]
+    else:
+        return None
+    if len(results) != count or not all(isinstance(completion, dict) for completion in results):
+        return None
+    return results
+
+def run_server_inference(prompts):
+    """Generate through llama-server so several prompts share one model load.
+
+    With --server the server outlives this run and is reused by later ones;
+    otherwise a server started here is shut down once the batch is done.
+    """
+    process = None
+    state = read_server_state()
+    if state is None:
+        state, process = start_server(persistent=args.server)
+    elif state["model"] != args.model:
+        print(f"❌ The background server (pid {state['pid']}) is serving {state['model']}; stop it before switching models", file=sys.stderr)
+        sys.exit(1)
+    else:
+        for key, requested in server_settings().items():
+            if state.get(key) != requested:
+                print(f"⚠️  Reusing the background server started with {key}={state.get(key)} (requested {requested}); "
+                      f"stop it to apply new settings", file=sys.stderr)
+    try:
+        generate_with_server(state, prompts)
+    finally:
+        if process is not None and not args.server:
+            stop_process(process)
+
+def generate_with_server(state, prompts):
+    """Send the prompts to a ready llama-server and report the completions and speeds."""
+    # Several prompts go out as one request so the server decodes them
+    # together in its parallel slots
+    start_time = time.time()
+    try:
+        status, result = server_request(state["port"], "POST", "/completion", {
+            "prompt": prompts[0] if len(prompts) == 1 else prompts,
+            "n_predict": args.n_predict,
+            "temperature": args.temperature,
+        })
+    except OSError as e:
+        print(f"❌ Could not reach llama-server on port {state['port']}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if status != 200 or result is None:
+        print(f"❌ Completion request failed with HTTP status {status}", file=sys.stderr)
+        sys.exit(1)
+    total_time = time.time() - start_time
+
+    results = parse_completions(result, len(prompts))
+    if results is None:
+        print(f"❌ Unexpected response from llama-server: expected {len(prompts)} completion(s)", file=sys.stderr)
+        sys.exit(1)
+    text_out = sys.stderr if args.json else sys.stdout
+    for prompt, completion in zip(prompts, results):
+        if len(prompts) > 1:
+            print(f"\n" + "-"*60, file=text_out)
+        print(prompt + completion.get("content", ""), file=text_out)
+
+    # Slots decode concurrently, so batch throughput is the sum of their rates
+    timings = [completion.get("timings", {}) for completion in results]
+    performance_metrics = {}
+    if all("prompt_per_second" in t for t in timings):
+        performance_metrics['prompt_eval_speed'] = sum(t["prompt_per_second"] for t in timings)
+        performance_metrics['prompt_eval_ms_per_token'] = sum(t["prompt_per_token_ms"] for t in timings) / len(timings)
+    if all("predicted_per_second" in t for t in timings):
+        performance_metrics['gen_speed'] = sum(t["predicted_per_second"] for t in timings)
+        performance_metrics['gen_ms_per_token'] = sum(t["predicted_per_token_ms"] for t in timings) / len(timings)
+    if args.json:
+        print_json_metrics(performance_metrics, total_time, prompts=len(prompts))
+    else:
+        print_speed_metrics(performance_metrics, total_time, state["threads"], prompts=len(prompts))
+
+def run_inference():
+    # Fail fast rather than paying for a llama.cpp launch that cannot succeed
+    if not os.path.isfile(args.model):
+        print(f"❌ Model file not found: {args.model}", file=sys.stderr)
+        sys.exit(1)
+    if args.ctx_size <= 0:
+        print(f"❌ Context size must be positive, got {args.ctx_size}", file=sys.stderr)
+        sys.exit(1)
+    if args.ctx_size > 8192 and not args.conversation:
+        print(f"⚠️  Context size {args.ctx_size} is large for a one-shot prompt; the KV cache will use extra memory", file=sys.stderr)
+    if args.threads is None:
+        if isinstance(args.affinity, list):
+            # One thread per CPU the user pinned us to
+            args.threads = len(args.affinity)
+            source = "--affinity CPUs"
+        else:
+            args.threads = default_thread_count()
+            source = "performance cores"
+        if not args.json:
+            print(f"🏃 Auto-selected {args.threads} threads ({source})")
+    prompts = load_prompts()
+    if args.json and args.conversation:
+        print("❌ --json is not supported in conversation mode", file=sys.stderr)
+        sys.exit(1)
+    if args.server or len(prompts) > 1:
+        if args.conversation:
+            print("❌ Conversation mode cannot be combined with --server or a prompt file", file=sys.stderr)
+            sys.exit(1)
+        if args.parallel is None:
+            args.parallel = min(len(prompts), 4)
+        run_server_inference(prompts)
+        return
+    prefetch_model(args.model)
+    command = [binary_path("llama-cli")] + model_options() + [
+        '-n', str(args.n_predict),
+        '-p', prompts[0],
         '--temp', str(args.temperature),
     ]
     if args.conversation:
         command.append("-cnv")
-    run_command(command, threads=args.threads, is_conversation=args.conversation)
+    run_command(command, threads=args.threads, is_conversation=args.conversation, affinity=select_affinity(),
+                json_output=args.json)
 
 def signal_handler(sig, frame):
-    print("Ctrl+C pressed, exiting...")
-    sys.exit(0)
+    """Pass Ctrl+C on to llama-cli so it stops, then let run_command report the run."""
+    global interrupted
+    process = current_process
+    if process is None:
+        print("Ctrl+C pressed, exiting...", file=sys.stderr)
+        sys.exit(0)
+    if process.poll() is not None:
+        # llama-cli already exited; run_command is about to report on it
+        return
+    try:
+        detached = os.getpgid(process.pid) != os.getpgrp()
+    except (AttributeError, OSError):
+        detached = False
+    if not detached:
+        # Conversation runs share our process group, so the terminal already
+        # delivered this Ctrl+C to llama-cli as well. The first one only stops
+        # the current reply, so run_command judges the interrupt by how
+        # llama-cli eventually exits
+        return
+    if interrupted:
+        # Second Ctrl+C: llama-cli did not shut down, stop waiting for it
+        process.kill()
+        return
+    interrupted = True
+    try:
+        os.killpg(process.pid, signal.SIGINT)
+    except OSError:
+        pass
 
-if __name__ == "__main__":
+# Usage: python run_inference.py -p "Microsoft Corporation is an American multinational corporation and technology company headquartered in Redmond, Washington."
+PARSER = argparse.ArgumentParser(description='Run inference')
+PARSER.add_argument("-m", "--model", type=str, help="Path to model file", required=False, default="models/bitnet_b1_58-3B/ggml-model-i2_s.gguf")
+PARSER.add_argument("-n", "--n-predict", type=int, help="Number of tokens to predict when generating text", required=False, default=128)
+PARSER.add_argument("-p", "--prompt", type=str, help="Prompt to generate text from, or @FILE to batch one prompt per line through llama-server", required=True)
+PARSER.add_argument("-t", "--threads", type=int, help="Number of threads to use (default: one per performance core)", required=False, default=None)
+PARSER.add_argument("-c", "--ctx-size", type=int, help="Size of the prompt context", required=False, default=2048)
+PARSER.add_argument("-b", "--batch-size", type=int, help="Logical batch size for prompt processing (larger speeds up long prompts but uses more memory)", required=False, default=2048)
+PARSER.add_argument("-ub", "--ubatch-size", type=int, help="Physical micro-batch size; values much larger than the default can slow down CPU inference", required=False, default=512)
+PARSER.add_argument("-temp", "--temperature", type=float, help="Temperature, a hyperparameter that controls the randomness of the generated text", required=False, default=0.8)
+PARSER.add_argument("--mmap", dest="mmap", action='store_true', default=None, help="Memory-map the model (default everywhere except Linux ARM)")
+PARSER.add_argument("--no-mmap", dest="mmap", action='store_false', help="Load the model into memory instead of memory-mapping it (default on Linux ARM)")
+PARSER.add_argument("--mlock", action='store_true', help="Lock the model in RAM so it is never swapped or paged out")
+PARSER.add_argument("--affinity", type=affinity_arg, help="CPU list to pin llama-cli to, e.g. 4-7 or 0,2,4, or 'none' to disable pinning (default: the performance cores on Linux)", required=False, default=None)
+PARSER.add_argument("--server", action='store_true', help="Serve prompts from a persistent background llama-server so the model is loaded only once")
+PARSER.add_argument("--port", type=int, help="Port of the background llama-server used by --server", required=False, default=8080)
+PARSER.add_argument("-np", "--parallel", type=int, help="Parallel decoding slots when starting the background llama-server (default: up to 4 for prompt files, else 1)", required=False, default=None)
+PARSER.add_argument("--json", action='store_true', help="Print only the speed metrics, as one JSON object on stdout (generated text goes to stderr)")
+PARSER.add_argument("-cnv", "--conversation", action='store_true', help="Whether to enable chat mode or not (for instruct models.)")
+
+def main():
+    global args
     signal.signal(signal.SIGINT, signal_handler)
-    # Usage: python run_inference.py -p "Microsoft Corporation is an American multinational corporation and technology company headquartered in Redmond, Washington."
-    parser = argparse.ArgumentParser(description='Run inference')
-    parser.add_argument("-m", "--model", type=str, help="Path to model file", required=False, default="models/bitnet_b1_58-3B/ggml-model-i2_s.gguf")
-    parser.add_argument("-n", "--n-predict", type=int, help="Number of tokens to predict when generating text", required=False, default=128)
-    parser.add_argument("-p", "--prompt", type=str, help="Prompt to generate text from", required=True)
-    parser.add_argument("-t", "--threads", type=int, help="Number of threads to use", required=False, default=2)
-    parser.add_argument("-c", "--ctx-size", type=int, help="Size of the prompt context", required=False, default=2048)
-    parser.add_argument("-temp", "--temperature", type=float, help="Temperature, a hyperparameter that controls the randomness of the generated text", required=False, default=0.8)
-    parser.add_argument("-cnv", "--conversation", action='store_true', help="Whether to enable chat mode or not (for instruct models.)")
-
-    args = parser.parse_args()
-    run_inference()
\ No newline at end of file
+    args = PARSER.parse_args()
+    run_inference()
+
+if __name__ == "__main__":
+    main()